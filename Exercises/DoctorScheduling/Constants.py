@@ -6,4 +6,6 @@ latest_start_time_for_nightshift = time(2,0)
 work_time_limit_for_pregnant_in_hours = 12
 limit_for_working_days_in_a_row = 12
 number_of_days_working_nightshift = 3
-number_of_days_rest_after_nightshift = 3
\ No newline at end of file
+number_of_days_rest_after_nightshift = 3
+# Bump whenever the formulation or the layout of cached models changes, so that old caches are not reused
+model_cache_format_version = 3
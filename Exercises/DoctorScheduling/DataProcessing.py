@@ -1,13 +1,43 @@
+import hashlib
+import os
+import pickle
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from datetime import timedelta
 from datetime import time
 import DomainModels as dm
 
 
-def get_data_from_excel(filename : str):
-    # Import of the data using pandas
+def read_excel_cached(filename : str, cache_dir=None):
+    # Parsing the workbook is slow, so optionally keep a pickled copy of the sheets in cache_dir.
+    # The copy is keyed on a hash of the workbook contents, since modification times survive copies and restores
+    if cache_dir is None:
+        return pd.read_excel(filename, sheet_name=["Doctors", "Hospitals"])
+    with open(filename, 'rb') as f:
+        workbook_hash = hashlib.sha1(f.read()).hexdigest()
+    cache_filename = os.path.join(cache_dir, os.path.basename(filename) + '.pkl')
+    try:
+        with open(cache_filename, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['workbook_hash'] == workbook_hash:
+            return cached['sheets']
+    except (OSError, EOFError, pickle.UnpicklingError, ImportError, AttributeError, KeyError, TypeError):
+        # A missing, truncated or incompatible cache is rebuilt from the workbook
+        pass
     df = pd.read_excel(filename, sheet_name=["Doctors", "Hospitals"])
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_filename + '.tmp', 'wb') as f:
+            pickle.dump({'workbook_hash': workbook_hash, 'sheets': df}, f)
+        os.replace(cache_filename + '.tmp', cache_filename)
+    except OSError:
+        pass
+    return df
+
+
+def get_data_from_excel(filename : str, cache_dir=None):
+    # Import of the data using pandas
+    df = read_excel_cached(filename, cache_dir)
     start_time = datetime(2019,7,1)
     end_time = datetime(2019,8,30)
     day_limit = 12 # Number of days a doctor can work in a row
@@ -16,34 +46,37 @@ def get_data_from_excel(filename : str):
     # Create a list of hospitals
     hospitals = df["Hospitals"]["ID"].tolist()
 
-    # Get the list of doctors
-    doctors = list()
-    for index, row in df["Doctors"].iterrows():
-        is_pregnant = row["Pregnant"] == "Yes"
-        work_list = list()
-        for hospital in hospitals:
-            if row[f'Work in {hospital}?'] == "Yes":
-                work_list.append(hospital)
-        doctors.append(dm.Doctor(row["Name"], is_pregnant, row["Allocation [%]"] / 100, work_list))
-
-    # Create a list of shifts
-    shifts = list()
-    shift_days = list()
-    current = start_time
-    weekday_times = [(6, 14), (14, 22), (22, 30)]
-    weekend_times = [(6, 18), (18, 30)]
-    while current <= end_time:
-        shift_days.append(current)
-        if current.weekday() < 5:
-            shifts += [dm.Shift(current + timedelta(hours=start), current + timedelta(hours=end))
-                       for start, end in weekday_times]
-        else:
-            shifts += [dm.Shift(current + timedelta(hours=start), current + timedelta(hours=end))
-                       for start, end in weekend_times]
-
-        current += timedelta(days=1)
-
-    placements = [dm.Placement(doctor, shift, hospital) for doctor in doctors for shift in shifts for hospital in hospitals]
+    # Get the list of doctors, reading each column once instead of going row by row
+    doctor_data = df["Doctors"]
+    work_columns = [f'Work in {hospital}?' for hospital in hospitals]
+    work_mask = (doctor_data[work_columns] == "Yes").to_numpy()
+    is_pregnant = (doctor_data["Pregnant"] == "Yes").to_numpy()
+    allocation = doctor_data["Allocation [%]"].to_numpy() / 100
+    names = doctor_data["Name"].to_numpy()
+    doctors = [dm.Doctor(names[i], bool(is_pregnant[i]), float(allocation[i]),
+                         [hospitals[j] for j in np.flatnonzero(work_mask[i])])
+               for i in range(len(names))]
+
+    # Create a list of shifts, computing the start and end times of all days at once
+    days = pd.date_range(start_time, end_time, freq='D')
+    shift_days = days.to_pydatetime().tolist()
+    weekday_times = np.array([(6, 14), (14, 22), (22, 30)])
+    weekend_times = np.array([(6, 18), (18, 30), (0, 0)]) # Padded to the number of weekday shifts
+    weekend_slots = np.array([True, True, False])
+    is_weekday = (days.weekday < 5)[:, None]
+    times = np.where(is_weekday[:, :, None], weekday_times, weekend_times).astype('timedelta64[h]')
+    is_shift = is_weekday | weekend_slots
+    starts = pd.DatetimeIndex((days.values[:, None] + times[:, :, 0])[is_shift]).to_pydatetime()
+    ends = pd.DatetimeIndex((days.values[:, None] + times[:, :, 1])[is_shift]).to_pydatetime()
+    shifts = [dm.Shift(start, end) for start, end in zip(starts, ends)]
+
+    # Only create placements a doctor is actually allowed to take
+    can_work_pregnant = np.array([shift.can_work_pregnant for shift in shifts], dtype=bool)
+    allowed = work_mask[:, None, :] & ~(is_pregnant[:, None, None] & ~can_work_pregnant[None, :, None])
+    doctor_idx, shift_idx, hospital_idx = np.nonzero(allowed)
+    placements = dm.Placements(doctors, shifts, hospitals, doctor_idx, shift_idx, hospital_idx,
+                               [shift.duration_in_hours for shift in shifts],
+                               [shift.start_date_ordinal for shift in shifts])
 
     nightshifts = [dm.Nightshift(doctor, shift_day) for doctor in doctors for shift_day in shift_days]
 
@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from datetime import datetime
+import numpy as np
 import Constants
 
 
@@ -11,7 +12,7 @@ class Doctor:
         self.name = name
         self.is_pregnant = is_pregnant
         self.allocation = allocation
-        self.work_locations = work_locations
+        self.work_locations = frozenset(work_locations)
 
 
 class Shift:
@@ -21,8 +22,10 @@ class Shift:
     def __init__(self, start_time, end_time):
         self.start_time = start_time
         self.end_time = end_time
+        self.start_date_ordinal = start_time.toordinal()
         self.duration_in_hours = (end_time - start_time).total_seconds() / Constants.seconds_in_one_hour
-        self.is_nightshift = start_time.time() >= Constants.earliest_start_time_for_nightshift or start_time.time() <= Constants.latest_start_time_for_nightshift
+        time_of_day = start_time.time()
+        self.is_nightshift = time_of_day >= Constants.earliest_start_time_for_nightshift or time_of_day <= Constants.latest_start_time_for_nightshift
         self.can_work_pregnant = self.duration_in_hours < Constants.work_time_limit_for_pregnant_in_hours and not self.is_nightshift
 
 
@@ -36,6 +39,36 @@ class Placement:
     hospital: str
 
 
+class Placements:
+    """
+    All placements stored as parallel arrays, where a placement is identified by its position in the arrays
+    """
+    def __init__(self, doctors, shifts, hospitals, doctor_idx, shift_idx, hospital_idx,
+                 shift_duration, shift_date):
+        self.doctors = doctors
+        self.shifts = shifts
+        self.hospitals = hospitals
+        self.doctor_idx = np.asarray(doctor_idx, dtype=np.int32)
+        self.shift_idx = np.asarray(shift_idx, dtype=np.int32)
+        self.hospital_idx = np.asarray(hospital_idx, dtype=np.int32)
+        self.shift_duration = np.asarray(shift_duration, dtype=np.float64)
+        self.shift_date = np.asarray(shift_date, dtype=np.int32)
+
+        # Attributes of each placement, looked up from its shift once
+        self.duration = self.shift_duration[self.shift_idx]
+        self.date = self.shift_date[self.shift_idx]
+
+    def __len__(self):
+        return len(self.doctor_idx)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, i):
+        return Placement(self.doctors[self.doctor_idx[i]], self.shifts[self.shift_idx[i]],
+                         self.hospitals[self.hospital_idx[i]])
+
+
 @dataclass(frozen=True)
 class Nightshift:
     """
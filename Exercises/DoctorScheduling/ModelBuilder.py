@@ -1,8 +1,11 @@
+import hashlib
+import os
 import ModelContainer
 import Constants
 
 class ModelBuilder:
-    def __init__(self, doctors, hospitals, shifts, shift_days, placements, nightshifts, total_work_time):
+    def __init__(self, doctors, hospitals, shifts, shift_days, placements, nightshifts, total_work_time, debug_names=False,
+                 model_cache=None):
         self.doctors = doctors
         self.hospitals = hospitals
         self.shifts = shifts
@@ -10,42 +13,79 @@ class ModelBuilder:
         self.placements = placements
         self.nightshifts = nightshifts
         self.total_work_time = total_work_time
+        self.debug_names = debug_names
+        # Directory to keep built models in, so that a scenario with the same structure doesn't rebuild it
+        self.model_cache = model_cache
 
         # Create model object
-        self.model = ModelContainer.ModelContainer()
+        self.model = ModelContainer.ModelContainer(debug_names)
 
     def solve(self):
         self.create_model()
         self.model.solve()
         return self.model.get_placement_list()
 
+    def resolve(self, total_work_time):
+        # Only the doctor allocations and the total work time may have changed since the last solve
+        self.total_work_time = total_work_time
+        self.model.update_allocations(total_work_time)
+        self.model.warm_start()
+        self.model.solve()
+        return self.model.get_placement_list()
+
     def create_model(self):
+        cached_model = self.cached_model_file()
+        if (cached_model is not None and os.path.exists(cached_model + '.npz')
+                and self.model.load(cached_model, self.placements)):
+            self.model.update_allocations(self.total_work_time)
+            return
+
         self.create_variables()
         self.add_constraints()
         self.add_objective_function()
 
+        if cached_model is not None:
+            os.makedirs(self.model_cache, exist_ok=True)
+            self.model.save(cached_model)
+
+    def cached_model_file(self):
+        if self.model_cache is None:
+            return None
+        # The allocations only enter right hand sides and bounds, so they are left out and updated after loading.
+        # The placements are hashed directly, since the rules that prune them can change without their inputs changing.
+        # Names are only stored in the cached model when debugging, so the debug flag is part of the key
+        structure = (Constants.model_cache_format_version,
+                     self.debug_names,
+                     tuple(d.name for d in self.doctors),
+                     tuple(self.hospitals),
+                     tuple((s.start_time, s.end_time) for s in self.shifts),
+                     tuple(self.shift_days),
+                     tuple((n.doctor.name, n.day) for n in self.nightshifts),
+                     Constants.limit_for_working_days_in_a_row,
+                     Constants.number_of_days_working_nightshift,
+                     Constants.number_of_days_rest_after_nightshift)
+        key = hashlib.sha1(repr(structure).encode())
+        key.update(self.placements.doctor_idx.tobytes())
+        key.update(self.placements.shift_idx.tobytes())
+        key.update(self.placements.hospital_idx.tobytes())
+        return os.path.join(self.model_cache, f'doctor_base_{key.hexdigest()}')
+
     def create_variables(self):
-        self.model.define_placement_variables(self.placements)
-        self.model.define_nightshift_change(self.nightshifts)
-        self.model.define_auxiliary_variables_for_doctors(self.doctors)
+        self.model.define_placement_variables(self.placements, self.shift_days)
+        self.model.define_worked_days()
+        self.model.define_nightshift_change(self.nightshifts, Constants.number_of_days_working_nightshift)
+        self.model.define_auxiliary_variables_for_doctors(self.doctors, self.total_work_time)
 
     def add_constraints(self):
-        for shift in self.shifts:
-            for hospital in self.hospitals:
-                self.model.force_shift_fulfillment(shift, hospital)
-
-        for doctor in self.doctors:
-            for day in self.shift_days:
-                self.model.one_shift_limit(doctor, day)
-                self.model.max_time_working(doctor, day, Constants.limit_for_working_days_in_a_row)
-
-            self.model.enforce_hospital_limit(doctor)
-            self.model.force_auxiliary_variables_1(doctor, self.total_work_time)
-            self.model.force_auxiliary_variables_2(doctor, self.total_work_time)
-
-        for nightshift in self.nightshifts:
-            self.model.force_nightshift_work(nightshift, Constants.number_of_days_working_nightshift)
-            self.model.force_rest(nightshift, Constants.number_of_days_working_nightshift, Constants.number_of_days_rest_after_nightshift)
+        self.model.force_shift_fulfillment()
+        self.model.break_hospital_symmetry()
+        self.model.one_shift_limit()
+        self.model.max_time_working(Constants.limit_for_working_days_in_a_row)
+        self.model.force_auxiliary_variables_1(self.total_work_time)
+        self.model.force_auxiliary_variables_2(self.total_work_time)
+        self.model.force_nightshift_work(self.nightshifts, Constants.number_of_days_working_nightshift)
+        self.model.force_rest(self.nightshifts, Constants.number_of_days_working_nightshift, Constants.number_of_days_rest_after_nightshift)
+        self.model.compile_constraints()
 
     def add_objective_function(self):
         self.model.set_objective_function()
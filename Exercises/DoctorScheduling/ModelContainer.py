@@ -1,78 +1,289 @@
+import os
+import zipfile
 import numpy as np
-import ssl
-import xpress as xp
-from datetime import timedelta
+from dataclasses import dataclass
+from typing import Callable
+import SparseRows
+
+
+@dataclass(frozen=True)
+class ConstraintFamily:
+    """
+    Constraints of the same form, one row for each element of an index set. The rows are only built when the
+    model is compiled, and the names only when debugging
+    """
+    name: str
+    rowtype: str
+    rhs: object
+    build_rows: Callable
+    row_names: Callable
+
 
 class ModelContainer:
-    def __init__(self):
+    def __init__(self, debug_names=False):
+        # Importing xpress sets up the solver licence, so only do it once a model is actually needed
+        import xpress as xp
         self.model = xp.problem("Doctor scheduling")
+        self.solution_statuses = (xp.mip_solution, xp.mip_optimal)
+        self.previous_solution = None
+        # Naming every variable and constraint is expensive for large models, so only do it when debugging
+        self.debug_names = debug_names
+        self.n_columns = 0
+        self.n_rows = 0
+        self.constraint_families = list()
+        self.family_rows = dict()
+
+    def add_columns(self, coltype, lb, ub, names):
+        n = len(lb)
+        columns = self.n_columns + np.arange(n)
+        self.model.addcols(np.zeros(n), np.zeros(n + 1, dtype=np.int64), [], [], lb, ub,
+                           names=(list(names) if self.debug_names else None))
+        if coltype != 'C':
+            self.model.chgcoltype(columns, [coltype] * n)
+        self.n_columns += n
+        return columns
+
+    def add_family(self, name, rowtype, rhs, build_rows, row_names):
+        self.constraint_families.append(ConstraintFamily(name, rowtype, rhs, build_rows, row_names))
+
+    def compile_constraints(self):
+        # Lower all declared families into a single batch of rows
+        rowtypes, rhs, starts, indices, values, names = [], [], [], [], [], []
+        n_rows = 0
+        n_elements = 0
+        for family in self.constraint_families:
+            family_indptr, family_indices, family_values = family.build_rows()
+            n_family_rows = len(family_indptr) - 1
+            self.family_rows[family.name] = self.n_rows + n_rows + np.arange(n_family_rows)
+            rowtypes += [family.rowtype] * n_family_rows
+            rhs.append(np.broadcast_to(np.asarray(family.rhs, dtype=np.float64), (n_family_rows,)))
+            starts.append(family_indptr[:-1] + n_elements)
+            indices.append(family_indices)
+            values.append(family_values)
+            if self.debug_names:
+                names += list(family.row_names())
+            n_rows += n_family_rows
+            n_elements += len(family_indices)
+        self.constraint_families = list()
+        if n_rows == 0:
+            return
+
+        self.model.addrows(rowtypes, np.concatenate(rhs), np.concatenate(starts + [[n_elements]]),
+                           np.concatenate(indices), np.concatenate(values), names=(names if self.debug_names else None))
+        self.n_rows += n_rows
+
+    def define_placement_variables(self, placements, shift_days):
+        self.placements = placements
+        self.shift_days = shift_days
+        n = len(placements)
+        self.x = self.add_columns('B', np.zeros(n), np.ones(n),
+                                  (f'x_{p.doctor.name}, {p.shift}, {p.hospital}' for p in placements))
+
+        self.day_idx = placements.date - shift_days[0].toordinal()
+
+    def define_worked_days(self):
+        # w[d * n_days + day] counts the shifts doctor d works on that day
+        n_doctors = len(self.placements.doctors)
+        n_days = len(self.shift_days)
+        self.w = self.add_columns('C', np.zeros(n_doctors * n_days), np.ones(n_doctors * n_days),
+                                  (f'Worked {doctor.name} on {shift_day}'
+                                   for doctor in self.placements.doctors for shift_day in self.shift_days))
+        self.w_doctor = np.repeat(np.arange(n_doctors), n_days)
+        self.w_day = np.tile(np.arange(n_days), n_doctors)
+
+    def define_nightshift_change(self, nightshifts, n_days_working):
+        n = len(nightshifts)
+        n_days = len(self.shift_days)
+        doctor_index = {doctor: d for d, doctor in enumerate(self.placements.doctors)}
+        first_day = self.shift_days[0].toordinal()
+        self.nightshift_doctor = np.array([doctor_index[n.doctor] for n in nightshifts], dtype=np.int64)
+        self.nightshift_day = np.array([n.day.toordinal() - first_day for n in nightshifts], dtype=np.int64)
+
+        # A block of nightshift work can only start on a day if the doctor has a placement on each of its days,
+        # otherwise the variable is fixed to at most zero right away
+        has_placement = np.zeros((len(self.placements.doctors), n_days + n_days_working), dtype=bool)
+        has_placement[self.placements.doctor_idx, self.day_idx] = True
+        can_start = np.ones((len(self.placements.doctors), n_days), dtype=bool)
+        for k in range(n_days_working):
+            can_start &= has_placement[:, k:k + n_days]
+        self.y = self.add_columns('I', -np.ones(n), can_start[self.nightshift_doctor, self.nightshift_day].astype(np.float64),
+                                  (f'y_{n.doctor.name},{n.day}' for n in nightshifts))
+
+    def define_auxiliary_variables_for_doctors(self, doctors, total_work_time):
+        # With at most one shift per day, a doctor can't work more than the longest placement of each day
+        longest_per_day = np.zeros((len(doctors), len(self.shift_days)))
+        np.maximum.at(longest_per_day, (self.placements.doctor_idx, self.day_idx), self.placements.duration)
+        self.max_hours = longest_per_day.sum(axis=1)
+        # Both auxiliary families sum over the placements of each doctor, so group them once
+        self.placements_by_doctor = SparseRows.group_order(self.placements.doctor_idx, len(doctors))
+        self.t = self.add_columns('C', np.zeros(len(doctors)), self.auxiliary_upper_bounds(total_work_time),
+                                  (f'Auxiliary for doctor {doctor.name}' for doctor in doctors))
+
+    def auxiliary_upper_bounds(self, total_work_time):
+        allocated_hours = self.allocated_hours(total_work_time)
+        return np.maximum(allocated_hours, self.max_hours - allocated_hours)
+
+    def force_shift_fulfillment(self):
+        p = self.placements
+        n_hospitals = len(p.hospitals)
+        self.add_family('Force shift fulfillment', 'E', 1,
+                        lambda: SparseRows.csr_from_entries(p.shift_idx * n_hospitals + p.hospital_idx, self.x,
+                                                            len(p.shifts) * n_hospitals),
+                        lambda: (f'Force shift fulfillment for shift {shift} and hospital {hospital}'
+                                 for shift in p.shifts for hospital in p.hospitals))
+
+    def break_hospital_symmetry(self):
+        # Hospitals that exactly the same doctors can work at are interchangeable. For every shift, require the
+        # doctor index to increase from one such hospital to the next, so only one of the equivalent orders remains
+        p = self.placements
+        equivalent_hospitals = dict()
+        for h, hospital in enumerate(p.hospitals):
+            eligible = tuple(d for d, doctor in enumerate(p.doctors) if hospital in doctor.work_locations)
+            equivalent_hospitals.setdefault(eligible, []).append(h)
+        pairs = np.array([pair for hospitals in equivalent_hospitals.values() for pair in zip(hospitals, hospitals[1:])],
+                         dtype=np.int64).reshape(-1, 2)
+        if len(pairs) == 0:
+            return
+        self.add_family('Hospital order', 'L', -1, lambda: self.hospital_order_rows(pairs),
+                        lambda: (f'Hospital order for shift {shift}, {p.hospitals[a]} before {p.hospitals[b]}'
+                                 for shift in p.shifts for a, b in pairs))
 
-    def define_placement_variables(self, placements):
-        self.x = {p: xp.var(vartype=xp.binary, name=f'x_{p.doctor.name}, {p.shift}, {p.hospital}') for p in placements}
-        self.model.addVariable(self.x)
-
-    def define_nightshift_change(self, nightshifts):
-        self.y = {n: xp.var(vartype=xp.integer, lb=-1, ub=1, name=f'y_{n.doctor.name},{n.day}') for n in nightshifts}
-        self.model.addVariable(self.y)
-
-    def define_auxiliary_variables_for_doctors(self, doctors):
-        self.t = {d: xp.var(vartype=xp.continuous, lb=0, name=f'Auxiliary for doctor {d.name}') for d in doctors}
-        self.model.addVariable(self.t)
-
-    def force_shift_fulfillment(self, shift, hospital):
-        shift_fulfillment = xp.constraint(xp.Sum(self.x[p] for p in self.x if
-                                                p.shift == shift and p.hospital == hospital) == 1,
-                                        name = f'Force shift fulfillment for shift {shift} and hospital {hospital}')
-        self.model.addConstraint(shift_fulfillment)
-
-    def one_shift_limit(self, doctor, shift_day):
-        shift_limit = xp.constraint(xp.Sum(self.x[p] for p in self.x
-                                        if p.doctor == doctor and
-                                        p.shift.start_time.date() == shift_day.date()) <= 1,
-                                name = f'One shift limit for {doctor.name} and day {shift_day}')
-        self.model.addConstraint(shift_limit)
-
-    def max_time_working(self, doctor, shift_day, day_limit):
-        time_working = xp.constraint(xp.Sum(self.x[p] for p in self.x for j in range(day_limit + 1)
-                                         if p.doctor == doctor and p.shift.start_time.date() ==
-                                         (shift_day + timedelta(days=j)).date()) <= day_limit,
-                                 name = f'Max working time for day {shift_day} and doctor {doctor.name}')
-        self.model.addConstraint(time_working)
-
-    def enforce_hospital_limit(self, doctor):
-        hospital_limit = xp.constraint(xp.Sum(self.x[p] for p in self.x
-                                       if p.doctor == doctor and p.hospital not in doctor.work_locations) == 0,
-                               name = f'Enforce hospital limits for doctor {doctor.name}')
-        self.model.addConstraint(hospital_limit)
-
-    def force_nightshift_work(self, nightshift, n_days_working):
-        nightshift_work = xp.constraint(xp.Sum(self.x[p] for p in self.x for k in range(n_days_working)
-                                              if p.doctor == nightshift.doctor and p.shift.start_time.date() == (nightshift.day.date() + timedelta(days = k))) >= 3*self.y[nightshift],
-                                      name = f'Force nightshift for doctor {nightshift.doctor} at day {nightshift.day}')
-        self.model.addConstraint(nightshift_work)
-
-    def force_rest(self, nightshift, n_days_working, n_days_rest):
-        force_rest = xp.constraint(xp.Sum(self.x[p] for p in self.x for k in range(n_days_working,n_days_working + n_days_rest)
-                                              if p.doctor == nightshift.doctor and p.shift.start_time.date() == (nightshift.day.date() + timedelta(days = k))) <= 3*(1-self.y[nightshift]),
-                                      name = f'Force rest for doctor {nightshift.doctor} at day {nightshift.day}')
-        self.model.addConstraint(force_rest)
-
-    def force_auxiliary_variables_1(self, doctor, total_work_time):
-        aux_definition1 = xp.constraint(xp.Sum(p.shift.duration_in_hours * self.x[p] for p in self.x if p.doctor == doctor) -
-                                         doctor.allocation * total_work_time <= self.t[doctor], name=f'Auxiliary 1 for {doctor}')
-        self.model.addConstraint(aux_definition1)
-
-    def force_auxiliary_variables_2(self, doctor, total_work_time):
-        aux_definition2 = xp.constraint(doctor.allocation * total_work_time -
-                                         xp.Sum(p.shift.duration_in_hours * self.x[p] for p in self.x if p.doctor == doctor)
-                                         <= self.t[doctor], name=f'Auxiliary 2 for {doctor}')
-        self.model.addConstraint(aux_definition2)
+    def hospital_order_rows(self, pairs):
+        p = self.placements
+        n_pairs = len(pairs)
+        row_idx, col_idx, coefficients = [], [], []
+        for side, sign in ((0, 1), (1, -1)):
+            pair_of_hospital = np.full(len(p.hospitals), -1)
+            pair_of_hospital[pairs[:, side]] = np.arange(n_pairs)
+            pair = pair_of_hospital[p.hospital_idx]
+            in_pair = pair >= 0
+            row_idx.append(p.shift_idx[in_pair] * n_pairs + pair[in_pair])
+            col_idx.append(self.x[in_pair])
+            coefficients.append(sign * (p.doctor_idx[in_pair] + 1.0))
+        return SparseRows.csr_from_entries(np.concatenate(row_idx), np.concatenate(col_idx), len(p.shifts) * n_pairs,
+                                           np.concatenate(coefficients))
+
+    def one_shift_limit(self):
+        # Defines the worked days, whose upper bound of one is the actual limit
+        p = self.placements
+        n_days = len(self.shift_days)
+        n_cells = len(self.w)
+        self.add_family('One shift limit', 'E', 0,
+                        lambda: SparseRows.csr_from_entries(
+                            np.concatenate((p.doctor_idx * n_days + self.day_idx, np.arange(n_cells))),
+                            np.concatenate((self.x, self.w)), n_cells,
+                            np.concatenate((np.ones(len(self.x)), -np.ones(n_cells)))),
+                        lambda: (f'One shift limit for {doctor.name} and day {shift_day}'
+                                 for doctor in p.doctors for shift_day in self.shift_days))
+
+    def max_time_working(self, day_limit):
+        p = self.placements
+        n_days = len(self.shift_days)
+
+        def build_rows():
+            row_idx, entry = SparseRows.rolling_window_entries(self.w_doctor, self.w_day, n_days, range(day_limit + 1))
+            return SparseRows.csr_from_entries(row_idx, self.w[entry], len(p.doctors) * n_days)
+
+        self.add_family('Max working time', 'L', day_limit, build_rows,
+                        lambda: (f'Max working time for day {shift_day} and doctor {doctor.name}'
+                                 for doctor in p.doctors for shift_day in self.shift_days))
+
+    def nightshift_window_rows(self, days, y_coefficient):
+        # One row per nightshift variable, summing the worked days of its doctor over the given days after it
+        n_days = len(self.shift_days)
+        n_nightshifts = len(self.y)
+        nightshift_of_cell = np.full(len(self.w), -1)
+        nightshift_of_cell[self.nightshift_doctor * n_days + self.nightshift_day] = np.arange(n_nightshifts)
+        cell_idx, entry = SparseRows.rolling_window_entries(self.w_doctor, self.w_day, n_days, days)
+        row_idx = nightshift_of_cell[cell_idx]
+        has_row = row_idx >= 0
+        return SparseRows.csr_from_entries(np.concatenate((row_idx[has_row], np.arange(n_nightshifts))),
+                                           np.concatenate((self.w[entry[has_row]], self.y)), n_nightshifts,
+                                           np.concatenate((np.ones(np.count_nonzero(has_row)),
+                                                           np.full(n_nightshifts, y_coefficient))))
+
+    def force_nightshift_work(self, nightshifts, n_days_working):
+        self.add_family('Force nightshift', 'G', 0,
+                        lambda: self.nightshift_window_rows(range(n_days_working), -3),
+                        lambda: (f'Force nightshift for doctor {n.doctor} at day {n.day}' for n in nightshifts))
+
+    def force_rest(self, nightshifts, n_days_working, n_days_rest):
+        self.add_family('Force rest', 'L', 3,
+                        lambda: self.nightshift_window_rows(range(n_days_working, n_days_working + n_days_rest), 3),
+                        lambda: (f'Force rest for doctor {n.doctor} at day {n.day}' for n in nightshifts))
+
+    def auxiliary_rows(self, sign):
+        # sign * (hours worked by doctor d) - t[d]
+        order, indptr = self.placements_by_doctor
+        return SparseRows.append_to_rows(indptr, self.x[order], sign * self.placements.duration[order],
+                                         self.t, -np.ones(len(self.t)))
+
+    def allocated_hours(self, total_work_time):
+        return np.array([doctor.allocation for doctor in self.placements.doctors]) * total_work_time
+
+    def force_auxiliary_variables_1(self, total_work_time):
+        self.add_family('Auxiliary 1', 'L', self.allocated_hours(total_work_time), lambda: self.auxiliary_rows(1),
+                        lambda: (f'Auxiliary 1 for {doctor}' for doctor in self.placements.doctors))
+
+    def force_auxiliary_variables_2(self, total_work_time):
+        self.add_family('Auxiliary 2', 'L', -self.allocated_hours(total_work_time), lambda: self.auxiliary_rows(-1),
+                        lambda: (f'Auxiliary 2 for {doctor}' for doctor in self.placements.doctors))
+
+    def update_allocations(self, total_work_time):
+        # The doctor allocations only appear in the auxiliary rows and bounds
+        allocated_hours = self.allocated_hours(total_work_time)
+        self.model.chgrhs(self.family_rows['Auxiliary 1'], allocated_hours)
+        self.model.chgrhs(self.family_rows['Auxiliary 2'], -allocated_hours)
+        self.model.chgbounds(self.t, ['U'] * len(self.t), self.auxiliary_upper_bounds(total_work_time))
 
     def set_objective_function(self):
-        self.model.setObjective(xp.Sum(self.t[d] for d in self.t.keys()))
+        self.model.chgobj(self.t, np.ones(len(self.t)))
+
+    def save(self, filename):
+        # Write both files under temporary names first, so an interrupted save never leaves a partial pair behind
+        temporary = f'{filename}.{os.getpid()}.tmp'
+        self.model.write(temporary + '.mps.gz', '')
+        np.savez(temporary + '.npz', x=self.x, w=self.w, y=self.y, t=self.t, max_hours=self.max_hours,
+                 auxiliary_rows_1=self.family_rows['Auxiliary 1'], auxiliary_rows_2=self.family_rows['Auxiliary 2'])
+        os.replace(temporary + '.mps.gz', filename + '.mps.gz')
+        os.replace(temporary + '.npz', filename + '.npz')
+
+    def load(self, filename, placements):
+        # Returns False, leaving the model untouched, if the cached model can't be read or doesn't belong to
+        # these placements, so that it is rebuilt instead
+        import xpress as xp
+        try:
+            with np.load(filename + '.npz') as layout:
+                if len(layout['x']) != len(placements):
+                    return False
+                x, w, y, t, max_hours = (layout[key] for key in ('x', 'w', 'y', 't', 'max_hours'))
+                auxiliary_rows = (layout['auxiliary_rows_1'], layout['auxiliary_rows_2'])
+            # A failed read leaves the problem empty, with any controls that were already set
+            self.model.read(filename + '.mps.gz')
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile, xp.SolverError, xp.ModelError):
+            return False
+        self.placements = placements
+        self.x, self.w, self.y, self.t, self.max_hours = x, w, y, t, max_hours
+        self.family_rows['Auxiliary 1'], self.family_rows['Auxiliary 2'] = auxiliary_rows
+        self.n_columns = self.model.attributes.cols
+        self.n_rows = self.model.attributes.rows
+        return True
 
     def solve(self):
         self.model.solve()
+        # Remember the final basis and solution, so the next solve can start from them after the allocations change
+        self.previous_solution = None
+        if self.model.attributes.mipstatus in self.solution_statuses:
+            self.row_status, self.column_status = list(), list()
+            self.model.getbasis(self.row_status, self.column_status)
+            self.previous_solution = self.model.getSolution()
+
+    def warm_start(self):
+        if self.previous_solution is None:
+            return
+        self.model.loadbasis(self.row_status, self.column_status)
+        self.model.addmipsol(self.previous_solution, None, 'previous')
 
     def get_placement_list(self):
-        return [placement for placement in self.x if self.model.getSolution(self.x[placement]) > 0.5]
\ No newline at end of file
+        solution = np.asarray(self.model.getSolution())
+        return [self.placements[i] for i in np.flatnonzero(solution[self.x] > 0.5)]
@@ -3,7 +3,7 @@ from datetime import datetime
 import DataProcessing
 
 class Scenario:
-    def __init__(self, doctors, hospitals, shifts, shift_days, placements, nightshifts, start_time, end_time):
+    def __init__(self, doctors, hospitals, shifts, shift_days, placements, nightshifts, start_time, end_time, model_cache=None):
         self.doctors = doctors
         self.hospitals = hospitals
         self.shifts = shifts
@@ -13,11 +13,20 @@ class Scenario:
         self.start_time = start_time
         self.end_time = end_time
         self.total_work_time = (end_time - start_time).days * (40/7)
+        self.model_cache = model_cache
+        self.model_builder = None
 
     def solve(self):
-        model_builder = ModelBuilder.ModelBuilder(self.doctors, self.hospitals, self.shifts, self.shift_days,
-                                                  self.placements, self.nightshifts, self.total_work_time)
-        return model_builder.solve()
+        self.model_builder = ModelBuilder.ModelBuilder(self.doctors, self.hospitals, self.shifts, self.shift_days,
+                                                       self.placements, self.nightshifts, self.total_work_time,
+                                                       model_cache=self.model_cache)
+        return self.model_builder.solve()
+
+    def resolve(self):
+        # For sweeps over the doctor allocations: reuse the model of the last solve and warm start from its solution
+        if self.model_builder is None:
+            return self.solve()
+        return self.model_builder.resolve(self.total_work_time)
 
 
 doctors, hospitals, shifts, shift_days, placements, nightshifts = DataProcessing.get_data_from_excel("DoctorData.xlsx")
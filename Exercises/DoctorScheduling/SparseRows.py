@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def group_order(row_idx, n_rows):
+    """
+    Sorts entries by their row, returning the order of the entries and the offset of each row in that order
+    """
+    order = np.argsort(row_idx, kind="stable")
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row_idx, minlength=n_rows), out=indptr[1:])
+    return order, indptr
+
+
+def csr_from_entries(row_idx, col_idx, n_rows, coefficients=None):
+    """
+    Assembles the (indptr, indices, values) arrays of a CSR matrix from its nonzero entries
+    """
+    order, indptr = group_order(row_idx, n_rows)
+    indices = np.asarray(col_idx)[order]
+    values = np.ones(len(order)) if coefficients is None else np.asarray(coefficients, dtype=np.float64)[order]
+    return indptr, indices, values
+
+
+def rolling_window_entries(group_idx, day_idx, n_days, days):
+    """
+    Expands entries indexed by (group, day) to the rows (group, first day) of all windows they fall into,
+    where a window starting at a given day covers that day plus the given offsets in days.
+    Returns the row of each expanded entry and the position of the original entry
+    """
+    offsets = np.asarray(list(days))
+    first_day = day_idx[:, None] - offsets[None, :]
+    entry = np.broadcast_to(np.arange(len(day_idx))[:, None], first_day.shape)
+    inside = first_day >= 0
+    return (group_idx[:, None] * n_days + first_day)[inside], entry[inside]
+
+
+def append_to_rows(indptr, indices, values, columns, coefficients):
+    """
+    Appends one entry, with the given column and coefficient, to the end of every row of a CSR matrix
+    """
+    n_rows = len(indptr) - 1
+    new_indptr = indptr + np.arange(n_rows + 1)
+    is_appended = np.zeros(new_indptr[-1], dtype=bool)
+    is_appended[new_indptr[1:] - 1] = True
+    new_indices = np.empty(new_indptr[-1], dtype=np.int64)
+    new_indices[is_appended] = columns
+    new_indices[~is_appended] = indices
+    new_values = np.empty(new_indptr[-1], dtype=np.float64)
+    new_values[is_appended] = coefficients
+    new_values[~is_appended] = values
+    return new_indptr, new_indices, new_values